@@ -1,9 +1,14 @@
 import abc
+import array
+import bisect
+import functools
+import itertools
 import re
+import string
 import sublime
 import sublime_plugin
 
-from typing import Any, Dict, List, Optional, Union, cast
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Pattern, Set, Tuple, Union, cast
 
 from .libs import char_width_converter
 from .libs.xpinyin import Pinyin
@@ -14,7 +19,10 @@ SETTINGS_FILENAME = "AceJump.sublime-settings"
 SYTNAX_FILENAME = "Packages/{}/AceJump.sublime-syntax".format(PACKAGE_NAME)
 XPINYIN_DICT_PATH = "Packages/{}/libs/xpinyin/Mandarin.dat".format(PACKAGE_NAME)
 
-CHINESE_REGEX_OBJ = re.compile("[\u4E00-\u9FD5]+", re.U)
+# single Chinese chars are checked by codepoints, which is cheaper than a regex match
+CHINESE_CODEPOINT_MIN = 0x4E00
+CHINESE_CODEPOINT_MAX = 0x9FD5
+CHINESE_REGEX_OBJ = re.compile("[{}-{}]+".format(chr(CHINESE_CODEPOINT_MIN), chr(CHINESE_CODEPOINT_MAX)))
 
 PHANTOM_TEMPLATE = """
 <body class="ace-jump-phantom">
@@ -35,6 +43,21 @@ HINTING_MODE_REPLACE_CHAR = 1
 HINTING_MODE_INLINE_PHANTOM = 2
 HINTING_MODE_DEFAULT = HINTING_MODE_REPLACE_CHAR
 
+# settings used by this plugin, with their default values
+CACHED_SETTINGS_DEFAULTS = {
+    "labels": "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    "labels_scope": "invalid",
+    "inactive_carets_scope": "text.plain",
+    "search_case_sensitivity": True,
+    "save_files_after_jump": False,
+    "jump_behind_last_characters": False,
+    "should_find_chinese": True,
+    "hinting_mode": HINTING_MODE_DEFAULT,
+    "phantom_css": "",
+    "view_settings_keys": [],
+}  # type: Dict[str, Any]
+
+settings_cache = {}  # type: Dict[str, Any]
 xpy = None  # type: Optional[Pinyin]
 last_index = 0
 hints = []  # type: List[sublime.Region]
@@ -45,7 +68,30 @@ ace_jump_active = False
 
 
 def plugin_loaded() -> None:
-    init_xpy()
+    settings = sublime.load_settings(SETTINGS_FILENAME)
+    settings.add_on_change(PACKAGE_NAME, refresh_settings_cache)
+    refresh_settings_cache()
+
+
+def plugin_unloaded() -> None:
+    sublime.load_settings(SETTINGS_FILENAME).clear_on_change(PACKAGE_NAME)
+
+
+def refresh_settings_cache() -> None:
+    """Snapshots settings into `settings_cache` so they don't have to be read on every command run"""
+
+    settings = sublime.load_settings(SETTINGS_FILENAME)
+    for key, default in CACHED_SETTINGS_DEFAULTS.items():
+        settings_cache[key] = settings.get(key, default)
+
+
+def get_xpy() -> Pinyin:
+    """Returns the pinyin converter, which is only initialized when Chinese chars are going to be found"""
+
+    if xpy is None:
+        init_xpy()
+
+    return cast(Pinyin, xpy)
 
 
 def init_xpy() -> None:
@@ -53,38 +99,127 @@ def init_xpy() -> None:
 
     pinyin_map = {}  # type: Dict[str, str]
     for line_num0, line in enumerate(sublime.load_resource(XPINYIN_DICT_PATH).splitlines()):
-        try:
-            k, v = line.split("\t")
+        k, sep, v = line.partition("\t")
+        if sep:
             pinyin_map[k] = v
-        except ValueError:
+        else:
             print_msg("Malformed pinyin data line {}: `{}`".format(line_num0 + 1, line))
 
-    xpy = Pinyin(pinyin_map)
+    # the map is not used anywhere else so it's safe to be used without being copied
+    xpy = Pinyin(pinyin_map, copy=False)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_regex(pattern: str, flags: int = 0) -> Pattern:
+    """Returns the compiled regex object, which is cached across keystrokes"""
+
+    return re.compile(pattern, flags)
+
+
+@functools.lru_cache(maxsize=16)
+def get_pinyin_index(content: str) -> Dict[str, str]:
+    """
+    Returns a dict which maps a pinyin initial to sorted Chinese chars in the content.
+    The result is cached since the content rarely changes during an AceJump session.
+    """
+
+    xpy = get_xpy()
+    pinyin_index = {}  # type: Dict[str, Set[str]]
+
+    # the pinyin initial of a char doesn't depend on its neighbours, so only distinct chars are looked up
+    for char in set(content):
+        if is_chinese_char(char):
+            pinyin_index.setdefault(xpy.get_initial(char).lower(), set()).add(char)
+
+    return {pinyin_initial: "".join(sorted(chars)) for pinyin_initial, chars in pinyin_index.items()}
+
+
+@functools.lru_cache(maxsize=256)
+def get_chinese_search_regex(regex: str, chinese_chars: str) -> str:
+    """Returns the search regex which also matches the given Chinese chars"""
+
+    return r"{}|[{}]".format(regex, chinese_chars) if chinese_chars else regex
+
+
+def clear_pinyin_caches() -> None:
+    """Releases cached pinyin results, which are only useful during an AceJump session"""
+
+    get_pinyin_index.cache_clear()
+
+
+def has_chinese_chars(text: str) -> bool:
+    """Checks whether the given text contains any Chinese char"""
+
+    # str.isascii() is O(1) in CPython but only available since Python 3.7
+    if hasattr(text, "isascii") and text.isascii():
+        return False
+
+    return CHINESE_REGEX_OBJ.search(text) is not None
+
+
+def is_chinese_char(char: str) -> bool:
+    """Checks whether the given single char is Chinese"""
+
+    return len(char) == 1 and CHINESE_CODEPOINT_MIN <= ord(char) <= CHINESE_CODEPOINT_MAX
 
 
 def get_active_views(window: sublime.Window, current_buffer_only: bool) -> List[sublime.View]:
     """Returns all currently visible views"""
 
-    if current_buffer_only:
-        group_indexes = [window.active_group()]
-    else:
-        group_indexes = list(range(window.num_groups()))
+    group_indexes = [window.active_group()] if current_buffer_only else range(window.num_groups())
+
+    # an empty group has no active view
+    return [view for view in map(window.active_view_in_group, group_indexes) if view is not None]
 
-    return [window.active_view_in_group(idx) for idx in group_indexes]  # type: ignore
 
+def get_fully_visible_region(view: sublime.View) -> sublime.Region:
+    """Returns the visible region without rows which are only partially shown in the viewport"""
 
-def set_views_setting(views: List[sublime.View], key: str, view_values: List[Any]) -> None:
-    """Sets the value for the setting in all given views"""
+    visible_region = view.visible_region()
+    line_height = view.line_height()
+    viewport_top = view.viewport_position()[1]
+    viewport_bottom = viewport_top + view.viewport_extent()[1]
+    layout_right = view.layout_extent()[0]
 
-    for view, view_value in zip(views, view_values):
-        view.settings().set(key, view_value)
+    begin = view.layout_to_text((0.0, viewport_top))
+    if view.text_to_layout(begin)[1] < viewport_top:
+        begin = view.layout_to_text((0.0, viewport_top + line_height))
+
+    end = view.layout_to_text((layout_right, viewport_bottom))
+    if view.text_to_layout(end)[1] + line_height > viewport_bottom:
+        end = view.layout_to_text((layout_right, viewport_bottom - line_height))
+
+    begin = max(begin, visible_region.begin())
+    end = min(end, visible_region.end())
+
+    # the viewport is too small to show any full row
+    if begin >= end:
+        return visible_region
+
+    # keep the trailing newline of the last row, which is needed by line mode
+    if view.substr(end) == "\n":
+        end += 1
+
+    return sublime.Region(begin, end)
+
+
+def get_target_region(view: sublime.View, region_type: str) -> sublime.Region:
+    """Returns the region of the view to be labeled"""
+
+    return {
+        "visible_region": get_fully_visible_region,
+        "current_line": lambda view: view.line(view.sel()[0]),
+    }.get(region_type)(view)
 
 
 def set_views_settings(views: List[sublime.View], keys: List[str], views_values: List[List[Any]]) -> None:
     """Sets the values for all settings in all given views"""
 
-    for key, view_values in zip(keys, views_values):
-        set_views_setting(views, key, view_values)
+    # view.settings() is an API call so get it only once per view
+    for view_index, view in enumerate(views):
+        settings = view.settings()
+        for key, view_values in zip(keys, views_values):
+            settings.set(key, view_values[view_index])
 
 
 def get_views_setting(views: List[sublime.View], key: str) -> List[Any]:
@@ -96,7 +231,10 @@ def get_views_setting(views: List[sublime.View], key: str) -> List[Any]:
 def get_views_settings(views: List[sublime.View], keys: List[str]) -> List[List[Any]]:
     """Gets the settings for every given view"""
 
-    return [get_views_setting(views, key) for key in keys]
+    # view.settings() is an API call so get it only once per view
+    views_settings = [view.settings() for view in views]
+
+    return [[settings.get(key) for settings in views_settings] for key in keys]
 
 
 def set_views_syntax(views: List[sublime.View], syntaxes: Union[str, List[str]]) -> None:
@@ -108,13 +246,15 @@ def set_views_syntax(views: List[sublime.View], syntaxes: Union[str, List[str]])
     if isinstance(syntaxes, str):
         syntaxes = [syntaxes]
 
-    for i in range(len(views)):
+    for i, view in enumerate(views):
         try:
             syntax = syntaxes[i]
         except IndexError:
             syntax = syntaxes[-1]
 
-        views[i].assign_syntax(syntax)
+        # assigning a syntax re-highlights the whole view so skip it when it's unchanged
+        if view.settings().get("syntax") != syntax:
+            view.assign_syntax(syntax)
 
 
 def set_views_sel(views: List[sublime.View], selections: List[sublime.Selection]) -> None:
@@ -173,26 +313,30 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
         self.target = ""
         self.views = []  # type: List[sublime.View]
         self.changed_views = []  # type: List[sublime.View]
-        self.breakpoints = []  # type: List[int]
+        self.breakpoints = array.array("i")  # label counts after each labeled view
+        self.pending_regex = None  # type: Optional[str]
+        self.has_labels = False
 
         self.all_views = get_active_views(self.window, current_buffer_only)
-        self.syntax = cast(str, get_views_setting(self.all_views, "syntax"))
+        self.syntax = cast(List[str], get_views_setting(self.all_views, "syntax"))
         self.sel = get_views_sel(self.all_views)
 
-        settings = sublime.load_settings(SETTINGS_FILENAME)
-        self.labels_scope = cast(str, settings.get("labels_scope", "invalid"))
-        self.inactive_carets_scope = cast(str, settings.get("inactive_carets_scope", "text.plain"))
-        self.labels = cast(str, settings.get("labels", "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"))
-        self.case_sensitivity = cast(bool, settings.get("search_case_sensitivity", True))
-        self.jump_behind_last = cast(bool, settings.get("jump_behind_last_characters", False))
-        self.save_files_after_jump = cast(bool, settings.get("save_files_after_jump", False))
-        self.hinting_mode = cast(int, settings.get("hinting_mode", HINTING_MODE_DEFAULT))
+        self.labels_scope = cast(str, settings_cache["labels_scope"])
+        self.inactive_carets_scope = cast(str, settings_cache["inactive_carets_scope"])
+        self.labels = cast(str, settings_cache["labels"])
+        self.case_sensitivity = cast(bool, settings_cache["search_case_sensitivity"])
+        self.jump_behind_last = cast(bool, settings_cache["jump_behind_last_characters"])
+        self.save_files_after_jump = cast(bool, settings_cache["save_files_after_jump"])
+        self.hinting_mode = cast(int, settings_cache["hinting_mode"])
 
-        self.view_settings_keys = cast(List[Any], settings.get("view_settings_keys", []))
+        self.view_settings_keys = cast(List[Any], settings_cache["view_settings_keys"])
         self.view_settings_values = get_views_settings(self.all_views, self.view_settings_keys)
 
         self.show_prompt(self.prompt(), self.init_value())
 
+        if settings_cache["should_find_chinese"]:
+            sublime.set_timeout(self.build_pinyin_indexes, 0)
+
     def is_enabled(self) -> bool:
         return not ace_jump_active
 
@@ -215,13 +359,18 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
             self.char = command
             if self.char in "<>":
                 # re.escape escapes these 2 characters but it isn't needed for view.find()
-                self.add_labels(self.regex().format(self.char))
+                self.pending_regex = self.regex().format(self.char)
             else:
-                self.add_labels(self.regex().format(re.escape(self.char)))
+                self.pending_regex = self.regex().format(re.escape(self.char))
+
+            # labeling may take a while so let Sublime repaint the input panel first
+            sublime.set_timeout(self.add_pending_labels, 0)
             return
 
         if len(command) == 2:
             self.target = command[1]
+            # the label key may come before the deferred labeling, which is deterministic
+            self.add_pending_labels()
 
         self.window.run_command("hide_panel", {"cancel": True})
 
@@ -230,6 +379,9 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
         global next_search, ace_jump_active
         next_search = False
 
+        # the prompt is cancelled so labels of the latest input are no longer needed
+        self.pending_regex = None
+
         self.remove_artifacts()
         set_views_sel(self.all_views, self.sel)
         set_views_syntax(self.all_views, self.syntax)
@@ -239,6 +391,7 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
 
         set_plugin_mode(MODE_DEFAULT)
         ace_jump_active = False
+        clear_pinyin_caches()
 
         """Saves changed views after jump is complete"""
         if self.save_files_after_jump:
@@ -260,6 +413,26 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
                 flags=sublime.DRAW_EMPTY | sublime.DRAW_NO_FILL,
             )
 
+    def build_pinyin_indexes(self) -> None:
+        """Builds pinyin indexes of views ahead so that the first keystroke doesn't have to"""
+
+        if not ace_jump_active:
+            return
+
+        region_type = self.get_region_type()
+        for view in self.all_views:
+            content = view.substr(get_target_region(view, region_type))
+            if has_chinese_chars(content):
+                get_pinyin_index(content)
+
+    def add_pending_labels(self) -> None:
+        """Adds labels for the latest input unless the prompt has been closed meanwhile"""
+
+        regex, self.pending_regex = self.pending_regex, None
+
+        if regex is not None and ace_jump_active:
+            self.add_labels(regex)
+
     def add_labels(self, regex: str) -> None:
         """Adds labels to characters matching the regex"""
 
@@ -268,34 +441,37 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
         last_index = 0
         hints = []
 
-        self.views = self.views_to_label()
+        views = self.views_to_label()
+        self.views = []  # views which still have to be labeled in the next batch
         self.region_type = self.get_region_type()
         self.changed_views = []  # type: List[sublime.View]
-        self.breakpoints = []  # type: List[int]
-        changed_buffers = []  # type: List[int]
-
-        for view in self.views[:]:
-            if view.buffer_id() in changed_buffers:
+        self.breakpoints = array.array("i")
+        changed_buffers = set()  # type: Set[int]
+        command_args = {
+            "regex": regex,
+            "char": self.target_char(),
+            "region_type": self.region_type,
+            "labels": self.labels,
+            "labels_scope": self.labels_scope,
+            "case_sensitive": self.case_sensitivity,
+        }
+
+        for view_index, view in enumerate(views):
+            buffer_id = view.buffer_id()
+            if buffer_id in changed_buffers:
+                self.views = views[view_index:]
                 break
 
-            view.run_command(
-                "add_ace_jump_labels",
-                {
-                    "regex": regex,
-                    "region_type": self.region_type,
-                    "labels": self.labels,
-                    "labels_scope": self.labels_scope,
-                    "case_sensitive": self.case_sensitivity,
-                },
-            )
+            view.run_command("add_ace_jump_labels", command_args)
             self.breakpoints.append(last_index)
             self.changed_views.append(view)
-            changed_buffers.append(view.buffer_id())
+            changed_buffers.add(buffer_id)
 
             if next_search:
+                self.views = views[view_index:]
                 break
 
-            self.views.remove(view)
+        self.has_labels = True
 
         if self.hinting_mode == HINTING_MODE_REPLACE_CHAR:
             set_views_syntax(self.all_views, SYTNAX_FILENAME)
@@ -304,12 +480,14 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
     def remove_labels(self) -> None:
         """Removes all previously added labels"""
 
-        last_breakpoint = 0
-        for breakpoint in self.breakpoints:
-            if breakpoint != last_breakpoint:
-                view = self.changed_views[self.view_for_index(breakpoint - 1)]
-                view.run_command("remove_ace_jump_labels")
-                last_breakpoint = breakpoint
+        # labels may have been removed already if the prompt is closed before deferred labeling
+        if not self.has_labels:
+            return
+
+        self.has_labels = False
+
+        for view in self.changed_views:
+            view.run_command("remove_ace_jump_labels")
 
     def remove_faked_carets(self) -> None:
         """Removes all previously added faked carets"""
@@ -326,6 +504,7 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
 
         region = hints[index].begin()
         view = self.changed_views[self.view_for_index(index)]
+        self.before_jump(view, index)
 
         self.window.focus_view(view)
         view.run_command("perform_ace_jump", {"target": region})
@@ -342,11 +521,10 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
     def view_for_index(self, index: int) -> int:
         """Returns a view index for the given label index"""
 
-        for breakpoint in self.breakpoints:
-            if index < breakpoint:
-                return self.breakpoints.index(breakpoint)
+        # breakpoints are appended in ascending order
+        view_index = bisect.bisect_right(self.breakpoints, index)
 
-        return -1
+        return view_index if view_index < len(self.breakpoints) else -1
 
     def valid_target(self, target: str) -> bool:
         """Check if jump target is valid"""
@@ -360,6 +538,11 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
 
         return "visible_region"
 
+    def target_char(self) -> str:
+        """Return the char which the regex searches for"""
+
+        return self.char
+
     @abc.abstractmethod
     def prompt(self) -> str:
         return ""
@@ -372,6 +555,9 @@ class AceJumpCommand(sublime_plugin.WindowCommand):
     def regex(self) -> str:
         return r""
 
+    def before_jump(self, view: sublime.View, index: int) -> None:
+        pass
+
     @abc.abstractmethod
     def after_jump(self, view: sublime.View) -> None:
         pass
@@ -412,13 +598,10 @@ class AceJumpCharCommand(AceJumpCommand):
             view.run_command("move", {"by": "characters", "forward": True})
             set_plugin_mode(MODE_DEFAULT)
 
-    def jump(self, index: int) -> None:
-        view = self.changed_views[self.view_for_index(index)]
+    def before_jump(self, view: sublime.View, index: int) -> None:
         if self.jump_behind_last and "\n" in view.substr(hints[index].end()):
             set_plugin_mode(MODE_JUMP_AFTER)
 
-        AceJumpCommand.jump(self, index)
-
 
 class AceJumpLineCommand(AceJumpCommand):
     """Specialized command for line-mode"""
@@ -432,6 +615,9 @@ class AceJumpLineCommand(AceJumpCommand):
     def regex(self) -> str:
         return r"(.*)[^\s](.*)\n"
 
+    def target_char(self) -> str:
+        return ""
+
     def after_jump(self, view: sublime.View) -> None:
         if mode == MODE_JUMP_AFTER:
             view.run_command("move", {"by": "lines", "forward": True})
@@ -459,6 +645,9 @@ class AceJumpWithinLineCommand(AceJumpCommand):
     def get_region_type(self) -> str:
         return "current_line"
 
+    def target_char(self) -> str:
+        return ""
+
 
 class AceJumpSelectCommand(sublime_plugin.WindowCommand):
     """Command for turning on select mode"""
@@ -485,110 +674,171 @@ class AddAceJumpLabelsCommand(sublime_plugin.TextCommand):
     """Command for adding labels to the views"""
 
     def run(
-        self, edit: sublime.Edit, regex: str, region_type: str, labels: str, labels_scope: str, case_sensitive: bool
+        self,
+        edit: sublime.Edit,
+        regex: str,
+        region_type: str,
+        labels: str,
+        labels_scope: str,
+        case_sensitive: bool,
+        char: str = "",
     ) -> None:
         global hints
 
-        settings = sublime.load_settings(SETTINGS_FILENAME)
-        self.should_find_chinese = cast(bool, settings.get("should_find_chinese", True))
-        self.hinting_mode = cast(int, settings.get("hinting_mode", HINTING_MODE_DEFAULT))
-        self.phantom_css = cast(str, settings.get("phantom_css", ""))
+        self.should_find_chinese = cast(bool, settings_cache["should_find_chinese"])
+        self.hinting_mode = cast(int, settings_cache["hinting_mode"])
+        self.phantom_css = cast(str, settings_cache["phantom_css"])
 
-        characters = self.find(regex, region_type, len(labels), case_sensitive)
-        self.add_labels(edit, characters, labels)
+        targets = self.find(regex, char, region_type, len(labels), case_sensitive)
+        characters = [region for region, _ in targets]
+        self.add_labels(edit, targets, labels)
 
         if self.hinting_mode == HINTING_MODE_REPLACE_CHAR:
             self.view.add_regions("ace_jump_hints", characters, labels_scope)
 
         hints += characters
 
-    def find(self, regex: str, region_type: str, max_labels: int, case_sensitive: bool) -> List[sublime.Region]:
-        """Returns a list with all occurences matching the regex"""
+    def find(
+        self, regex: str, char: str, region_type: str, max_labels: int, case_sensitive: bool
+    ) -> List[Tuple[sublime.Region, str]]:
+        """Returns a list with all occurences matching the regex, along with the first char of each occurence"""
 
         global next_search, last_index
 
-        found_regions = []  # type: List[sublime.Region]
+        found_targets = []  # type: List[Tuple[sublime.Region, str]]
 
         region = self.get_target_region(region_type)
         content = self.view.substr(region)
         next_search = next_search if next_search else region.begin()
         last_search = region.end()
 
-        if self.should_find_chinese:
+        # pinyin initials are always letters so there is no need to find Chinese chars for other chars
+        if self.should_find_chinese and (not char or char in string.ascii_letters) and has_chinese_chars(content):
             # 測試用句子：如果方法中若传入变量，那么直接加前缀是不可以了。而是要将变量转为utf-8编码
             # find matched Chinese chars from the target region
-            matched_chinese_chars = set()
-            for match in CHINESE_REGEX_OBJ.finditer(content):
-                chinese_string = content[slice(*match.span())]
+            pinyin_index = get_pinyin_index(content)
 
-                for idx, char_pinyin in enumerate(xpy.get_pinyin(chinese_string, "-").split("-")):
-                    if re.match(regex, char_pinyin[0]):
-                        matched_chinese_chars.add(chinese_string[idx])
+            if char:
+                # the regex only searches for the given char, so just look up its pinyin initial
+                # pinyin initials are in lowercase, so an uppercase char only matches them if case-insensitive
+                matched_chinese_chars = pinyin_index.get(char if case_sensitive else char.lower(), "")
+            else:
+                regex_obj = compile_regex(regex)
+                matched_chinese_chars = "".join(
+                    chinese_chars
+                    for pinyin_initial, chinese_chars in pinyin_index.items()
+                    if regex_obj.match(pinyin_initial)
+                )
+                matched_chinese_chars = "".join(sorted(matched_chinese_chars))
 
             # add matched Chinese chars into the search regex which is used later
-            if matched_chinese_chars:
-                regex += r"|[{}]".format("".join(matched_chinese_chars))
-
-        while next_search < last_search and last_index < max_labels:
-            word = self.view.find(regex, next_search, 0 if case_sensitive else sublime.IGNORECASE)
-
+            # the regex is kept identical for the same chars so that it can be reused by Sublime
+            regex = get_chinese_search_regex(regex, matched_chinese_chars)
+
+        # get all matches with a single API call rather than calling view.find() for every match
+        flags = 0 if case_sensitive else sublime.IGNORECASE
+        regex_obj = compile_regex(regex, 0 if case_sensitive else re.IGNORECASE)
+        if not regex_obj.search(content, next_search - region.begin()):
+            # nothing to be found so don't bother Sublime
+            words = []  # type: Iterable[sublime.Region]
+        elif int(sublime.version()) >= 4181:
+            words = self.view.find_all(regex, flags, within=sublime.Region(next_search, last_search))
+        else:
+            # find_all() would search the whole view here, which is much slower than the target region
+            words = self.find_iter(regex, next_search, last_search, flags)
+
+        # don't look for more matches than there are labels left
+        for word in itertools.islice(words, max_labels - last_index):
             if not word or word.end() > last_search:
                 break
 
             last_index += 1
             next_search = word.end()
-            found_regions.append(sublime.Region(word.begin(), word.begin() + 1))
+            # the char is taken from the content so that it doesn't have to be fetched via view.substr() later
+            found_targets.append(
+                (sublime.Region(word.begin(), word.begin() + 1), content[word.begin() - region.begin()])
+            )
 
         if last_index < max_labels:
             next_search = False
 
-        return found_regions
+        return found_targets
+
+    def find_iter(self, regex: str, begin: int, end: int, flags: int) -> Iterator[sublime.Region]:
+        """Yields matches of the regex between `begin` and `end` by calling view.find() repeatedly"""
+
+        while begin < end:
+            word = self.view.find(regex, begin, flags)
+
+            if not word or word.end() > end:
+                return
 
-    def add_labels(self, edit: sublime.Edit, regions: List[sublime.Region], labels: str) -> None:
+            yield word
+            begin = word.end()
+
+    def add_labels(self, edit: sublime.Edit, targets: List[Tuple[sublime.Region, str]], labels: str) -> None:
         """Replaces the given regions with labels"""
 
         phantoms = []  # List[sublime.Phantom]
+        target_labels = labels[last_index - len(targets) : last_index]
 
-        for idx, region in enumerate(regions):
-            label = labels[last_index + idx - len(regions)]
-
-            if self.hinting_mode == HINTING_MODE_REPLACE_CHAR:
+        if self.hinting_mode == HINTING_MODE_REPLACE_CHAR:
+            replacements = [
                 # if the target char is Chinese,
                 # use full-width label to prevent from content position shifting
-                if CHINESE_REGEX_OBJ.match(self.view.substr(region)):
-                    label = char_width_converter.h2f(label)
-
-                self.view.replace(edit, region, label)
-            elif self.hinting_mode == HINTING_MODE_INLINE_PHANTOM:
-                phantoms.append(
-                    sublime.Phantom(
-                        region,
-                        PHANTOM_TEMPLATE.format(css=self.phantom_css, label=label),
-                        sublime.LAYOUT_INLINE,
-                    )
-                )
+                char_width_converter.h2f_char(label) if is_chinese_char(target_char) else label
+                for label, (_, target_char) in zip(target_labels, targets)
+            ]
+
+            if replacements:
+                self.replace_regions(edit, [region for region, _ in targets], replacements)
+        elif self.hinting_mode == HINTING_MODE_INLINE_PHANTOM:
+            # only the label differs between phantoms, so the template is formatted only once
+            phantom_content = PHANTOM_TEMPLATE.format(css=self.phantom_css, label="\x00")
+            phantoms = [
+                sublime.Phantom(region, phantom_content.replace("\x00", label), sublime.LAYOUT_INLINE)
+                for label, (region, _) in zip(target_labels, targets)
+            ]
 
         ps = get_view_phantom_set(self.view)
         ps.update(phantoms)
 
+    def replace_regions(self, edit: sublime.Edit, regions: List[sublime.Region], replacements: List[str]) -> None:
+        """Replaces the given ascending regions, where adjacent regions are merged into one replacement"""
+
+        # all replacements are done with the same edit so they are already a single undo step.
+        # regions are merged only if adjacent because replacing the text between them would also
+        # collapse carets, bookmarks and other regions inside it, which undo doesn't bring back.
+        runs = []  # type: List[List[Any]]
+        for region, replacement in zip(regions, replacements):
+            if runs and runs[-1][1] == region.begin():
+                runs[-1][1] = region.end()
+                runs[-1][2].append(replacement)
+            else:
+                runs.append([region.begin(), region.end(), [replacement]])
+
+        # replace from the back so that former regions won't be shifted
+        for begin, end, run_replacements in reversed(runs):
+            self.view.replace(edit, sublime.Region(begin, end), "".join(run_replacements))
+
     def get_target_region(self, region_type: str) -> sublime.Region:
-        return {
-            "visible_region": lambda view: view.visible_region(),
-            "current_line": lambda view: view.line(view.sel()[0]),
-        }.get(region_type)(self.view)
+        return get_target_region(self.view, region_type)
 
 
 class RemoveAceJumpLabelsCommand(sublime_plugin.TextCommand):
     """Command for removing labels from the views"""
 
     def run(self, edit: sublime.Edit) -> None:
-        settings = sublime.load_settings(SETTINGS_FILENAME)
-        self.hinting_mode = cast(bool, settings.get("hinting_mode", HINTING_MODE_DEFAULT))
+        self.hinting_mode = cast(int, settings_cache["hinting_mode"])
 
         if self.hinting_mode == HINTING_MODE_REPLACE_CHAR:
+            # a view without labels has not been modified so there is nothing to undo
+            has_labels = bool(self.view.get_regions("ace_jump_hints"))
             self.view.erase_regions("ace_jump_hints")
-            self.view.end_edit(edit)
-            self.view.run_command("undo")
+
+            if has_labels:
+                self.view.end_edit(edit)
+                self.view.run_command("undo")
         elif self.hinting_mode == HINTING_MODE_INLINE_PHANTOM:
             ps = get_view_phantom_set(self.view)
             ps.update([])
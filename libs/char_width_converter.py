@@ -1,7 +1,7 @@
 # modified from https://pypi.org/project/full-width-to-half-width
 
-FULL_TO_HALF_TABLE = {i + 0xFEE0: i for i in range(0x21, 0x7F)}
-HALF_TO_FULL_TABLE = {i: i + 0xFEE0 for i in range(0x21, 0x7F)}
+FULL_TO_HALF_TABLE = str.maketrans({chr(i + 0xFEE0): chr(i) for i in range(0x21, 0x7F)})
+HALF_TO_FULL_TABLE = str.maketrans({chr(i): chr(i + 0xFEE0) for i in range(0x21, 0x7F)})
 
 
 def f2h(string: str) -> str:
@@ -14,3 +14,9 @@ def h2f(string: str) -> str:
     """ Convert into full-width. """
 
     return string.translate(HALF_TO_FULL_TABLE)
+
+
+def h2f_char(char: str) -> str:
+    """ Convert a single char into full-width. """
+
+    return HALF_TO_FULL_TABLE.get(ord(char), char)
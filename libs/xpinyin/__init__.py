@@ -3,7 +3,6 @@
 from __future__ import unicode_literals
 
 import os.path
-import re
 
 PinyinToneMark = {
     0: u"aoeiuv\u00fc",
@@ -12,6 +11,14 @@ PinyinToneMark = {
     3: u"\u01ce\u01d2\u011b\u01d0\u01d4\u01da\u01da",
     4: u"\u00e0\u00f2\u00e8\u00ec\u00f9\u01dc\u01dc",
 }
+PinyinVowels = frozenset(PinyinToneMark[0])
+
+# (vowel, tone) => the vowel with the tone mark
+PinyinToneTable = {
+    (vowel, tone): PinyinToneMark[tone][idx]
+    for idx, vowel in enumerate(PinyinToneMark[0])
+    for tone in range(1, 5)
+}
 
 
 class Pinyin(object):
@@ -54,51 +61,107 @@ class Pinyin(object):
 
     data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Mandarin.dat")
 
-    def __init__(self, data_dict=None):
+    # the dict loaded from `data_path`, which is shared by all instances
+    _shared_dict = None
+
+    def __init__(self, data_dict=None, copy=True):
+        # with `copy=False`, the caller must not mutate `data_dict` afterwards
         if data_dict is None:
-            self.dict = {}
-            with open(self.data_path) as file:
-                for line in file:
-                    k, v = line.split("\t")
-                    self.dict[k] = v
-        else:
+            if Pinyin._shared_dict is None:
+                Pinyin._shared_dict = self.load_dict(self.data_path)
+            self.dict = Pinyin._shared_dict
+        elif copy:
             self.dict = data_dict.copy()
+        else:
+            self.dict = data_dict
+
+        # the initial of the first reading of each char
+        # these are keyed by codepoints so that lookups don't have to format a hex string per char
+        self.initials = {}
+        for k, v in self.dict.items():
+            try:
+                code = int(k, 16)
+            except ValueError:
+                continue
+            initial = v.lstrip()[:1]
+            if initial:
+                self.initials[code] = initial
+
+        # the first reading of each char, with and without its tone number
+        # only get_pinyin() needs these so they are built on its first call
+        self.readings = None
+        self.toneless_readings = None
+
+    def build_readings(self):
+        self.readings = {}
+        self.toneless_readings = {}
+        for k, v in self.dict.items():
+            try:
+                code = int(k, 16)
+            except ValueError:
+                continue
+            words = v.split(None, 1)
+            if words:
+                self.readings[code] = words[0]
+                self.toneless_readings[code] = words[0][:-1]
+
+    @staticmethod
+    def load_dict(path):
+        data_dict = {}
+        with open(path) as file:
+            for line in file:
+                k, sep, v = line.partition("\t")
+                if sep:
+                    data_dict[k] = v.rstrip("\n")
+        return data_dict
 
     @staticmethod
     def decode_pinyin(s):
-        s = s.lower()
-        r = ""
-        t = ""
-        for c in s:
+        r = []
+        t = []
+        for c in s.lower():
             if "a" <= c <= 'z':
-                t += c
+                t.append(c)
             elif c == ':':
                 assert t[-1] == 'u'
-                t = t[:-1] + "\u00fc"
+                t[-1] = "\u00fc"
             else:
                 if '0' <= c <= '5':
                     tone = int(c) % 5
                     if tone != 0:
-                        m = re.search("[aoeiuv\u00fc]+", t)
-                        if m is None:
-                            # pass when no vowels find yet
-                            t += c
-                        elif len(m.group(0)) == 1:
-                            # if just find one vowels, put the mark on it
-                            t = t[:m.start(0)] \
-                                + PinyinToneMark[tone][PinyinToneMark[0].index(m.group(0))] \
-                                + t[m.end(0):]
-                        else:
-                            # mark on vowels which search with "a, o, e" one by one
-                            # when "i" and "u" stand together, make the vowels behind
-                            for num, vowels in enumerate(("a", "o", "e", "ui", "iu")):
-                                if vowels in t:
-                                    t = t.replace(vowels[-1], PinyinToneMark[tone][num])
-                                    break
-                r += t
-                t = ""
-        r += t
-        return r
+                        Pinyin.mark_tone(t, c, tone)
+                r.extend(t)
+                t = []
+        r.extend(t)
+        return "".join(r)
+
+    @staticmethod
+    def mark_tone(t, c, tone):
+        # find the first run of vowels
+        start = 0
+        while start < len(t) and t[start] not in PinyinVowels:
+            start += 1
+        end = start
+        while end < len(t) and t[end] in PinyinVowels:
+            end += 1
+
+        if start == end:
+            # pass when no vowels find yet
+            t.append(c)
+        elif end - start == 1:
+            # if just find one vowels, put the mark on it
+            t[start] = PinyinToneTable[t[start], tone]
+        else:
+            # mark on vowels which search with "a, o, e" one by one
+            # when "i" and "u" stand together, make the vowels behind
+            syllable = "".join(t)
+            for num, vowels in enumerate(("a", "o", "e", "ui", "iu")):
+                if vowels in syllable:
+                    mark = PinyinToneMark[tone][num]
+                    for idx, v in enumerate(t):
+                        if v == vowels[-1]:
+                            t[idx] = mark
+                    break
 
     @staticmethod
     def convert_pinyin(word, convert):
@@ -111,17 +174,20 @@ class Pinyin(object):
 
     def get_pinyin(self, chars=u'你好', splitter=u'-',
                    tone_marks=None, convert='lower'):
+        if self.readings is None:
+            self.build_readings()
+
         result = []
         flag = 1
         for char in chars:
-            key = "%X" % ord(char)
+            key = ord(char)
             try:
                 if tone_marks == 'marks':
-                    word = self.decode_pinyin(self.dict[key].split()[0].strip())
+                    word = self.decode_pinyin(self.readings[key])
                 elif tone_marks == 'numbers':
-                    word = self.dict[key].split()[0].strip()
+                    word = self.readings[key]
                 else:
-                    word = self.dict[key].split()[0].strip()[:-1]
+                    word = self.toneless_readings[key]
                 word = self.convert_pinyin(word, convert)
                 result.append(word)
                 flag = 1
@@ -135,7 +201,7 @@ class Pinyin(object):
 
     def get_initial(self, char=u'你'):
         try:
-            return self.dict["%X" % ord(char)].split(" ")[0][0]
+            return self.initials[ord(char)]
         except KeyError:
             return char
 
@@ -144,7 +210,7 @@ class Pinyin(object):
         flag = 1
         for char in chars:
             try:
-                result.append(self.dict["%X" % ord(char)].split(" ")[0][0])
+                result.append(self.initials[ord(char)])
                 flag = 1
             except KeyError:
                 if flag: